@@ -1,8 +1,16 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request
 import pandas as pd
-import math
+import pyarrow as pa
+import numpy as np
+import orjson
+from numba import njit
+import os
 import unicodedata
 import re
+import hashlib
+from collections import namedtuple
+from functools import lru_cache
+from operator import attrgetter
 
 app = Flask(__name__)
 
@@ -12,11 +20,29 @@ app = Flask(__name__)
 def remove_acentos(s: str) -> str:
     return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
 
+# Teto por item: nenhum box comporta isso, e mantém as quantidades dentro de int64 (arrays do Numba)
+QTD_MAX = 10**9
+
+def parse_qtd(raw) -> int:
+    """
+    Converte o valor bruto de um campo qty_<slug> em quantidade (inválido/negativo vira 0).
+    Valores acima de QTD_MAX são limitados a ele.
+    """
+    try:
+        return min(QTD_MAX, max(0, int((raw or "0").strip())))
+    except ValueError:
+        return 0
+
+_SLUG_STRIP = re.compile(r"[^a-z0-9\s\-_/]")
+_SLUG_WS = re.compile(r"\s+")
+_SLUG_SEP = str.maketrans("/-", "  ")
+
+@lru_cache(maxsize=None)
 def slugify(s: str) -> str:
     s = remove_acentos(s.strip().lower())
-    s = re.sub(r"[^a-z0-9\s\-_/]", "", s)
-    s = s.replace("/", " ").replace("-", " ").replace("  ", " ")
-    s = re.sub(r"\s+", "_", s).strip("_")
+    s = _SLUG_STRIP.sub("", s)
+    s = s.translate(_SLUG_SEP)
+    s = _SLUG_WS.sub("_", s).strip("_")
     return s
 
 # ===========================
@@ -46,23 +72,62 @@ catalogo = {
     "poltrona":             {"m3": 0.53, "empilhavel": False, "altura": 1.00},
 }
 
-# Monta lista para UI (usada no template) com slug e metadados
-itens_ui = []
-for nome, meta in catalogo.items():
-    itens_ui.append({
-        "nome": nome,
-        "slug": slugify(nome),
-        "m3": meta["m3"],
-        "empilhavel": meta.get("empilhavel", False),
-        "max_emp": meta.get("max_emp", 1),
-        "altura": meta.get("altura", 0.5),
-    })
-itens_ui = sorted(itens_ui, key=lambda x: x["nome"])
+# Monta lista imutável para UI (usada no template) com slug e metadados
+ItemUI = namedtuple("ItemUI", "nome slug m3 empilhavel max_emp altura")
+ITENS_UI = tuple(sorted(
+    (
+        ItemUI(
+            nome=nome,
+            slug=slugify(nome),
+            m3=meta["m3"],
+            empilhavel=meta.get("empilhavel", False),
+            max_emp=meta.get("max_emp", 1),
+            altura=meta.get("altura", 0.5),
+        )
+        for nome, meta in catalogo.items()
+    ),
+    key=attrgetter("nome"),
+))
+
+# slugs dos itens da UI (campos do formulário: qty_<slug>)
+ITEMS_SLUGS = tuple(it.slug for it in ITENS_UI)
+
+# slug -> (nome, m3, empilhavel, max_emp, altura), montado uma única vez
+SLUG_TO_META = {
+    slugify(k): (k, v["m3"], v.get("empilhavel", False), v.get("max_emp", 1), v.get("altura", 0.5))
+    for k, v in catalogo.items()
+}
 
 # ===========================
 # Boxes
 # ===========================
-df_boxes = pd.read_excel("Boxes.xlsx")
+BOXES_XLSX = "Boxes.xlsx"
+BOXES_FEATHER = "Boxes.feather"
+
+def carregar_boxes() -> pd.DataFrame:
+    """
+    Lê a planilha de boxes a partir do cache .feather (Arrow), bem mais rápido que o openpyxl.
+    O .xlsx continua sendo a fonte: o cache é refeito quando não existe ou está mais antigo.
+    """
+    if (os.path.exists(BOXES_FEATHER)
+            and os.path.getmtime(BOXES_FEATHER) >= os.path.getmtime(BOXES_XLSX)):
+        return pd.read_feather(BOXES_FEATHER)
+
+    df = pd.read_excel(BOXES_XLSX)
+    # o cache só acelera a inicialização: se não der para gravá-lo (diretório somente leitura,
+    # coluna com tipos mistos que o Arrow recusa...), segue com o que veio do .xlsx
+    tmp = f"{BOXES_FEATHER}.{os.getpid()}.tmp"
+    try:
+        df.to_feather(tmp)
+        os.replace(tmp, BOXES_FEATHER)
+    except (OSError, pa.ArrowException):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+    return df
+
+df_boxes = carregar_boxes()
 
 # Renomeia colunas para nomes estáveis
 df_boxes = df_boxes.rename(columns={
@@ -71,9 +136,8 @@ df_boxes = df_boxes.rename(columns={
 })
 
 # Converte colunas numéricas
-for col in ["Metros Quadrados", "Metros Cubicos", "Largura", "Comprimento", "Altura"]:
-    if col in df_boxes.columns:
-        df_boxes[col] = pd.to_numeric(df_boxes[col], errors="coerce")
+cols_num = [c for c in ["Metros Quadrados", "Metros Cubicos", "Largura", "Comprimento", "Altura"] if c in df_boxes.columns]
+df_boxes[cols_num] = df_boxes[cols_num].apply(pd.to_numeric, errors="coerce")
 
 # Filtra apenas disponíveis se a coluna existir
 if "Status" in df_boxes.columns:
@@ -82,145 +146,229 @@ if "Status" in df_boxes.columns:
 # Remove linhas sem volume/altura
 df_boxes = df_boxes.dropna(subset=["Metros Cubicos", "Altura"])
 
+# Ordena por volume cúbico: o primeiro box viável já é o menor
+df_boxes = df_boxes.sort_values("Metros Cubicos", kind="stable").reset_index(drop=True)
+
+# Extrai arrays uma única vez (a tabela é estática) para não usar pandas por requisição
+BOX_ALTURAS = df_boxes["Altura"].to_numpy(dtype=np.float64)
+BOX_M3 = df_boxes["Metros Cubicos"].to_numpy(dtype=np.float64)
+BOX_META = df_boxes[["Box", "Largura", "Comprimento", "Altura", "Metros Quadrados", "Metros Cubicos"]].to_dict("records")
+
+# O DataFrame não é mais usado depois da extração; libera a memória do worker
+del df_boxes, cols_num
+
 # ===========================
 # Cálculo com empilhamento por altura do box
 # ===========================
-def calcular_itens(qtd_por_slug: dict):
-    """Transforma as quantidades do formulário em uma lista de itens normalizados com metadados."""
-    itens = []
-    slug_to_nome = {slugify(k): k for k in catalogo.keys()}
+# Itens selecionados como arrays paralelos (uma posição por item), prontos para o núcleo Numba
+Items = namedtuple("Items", "nome qtd m3 empilhavel max_emp altura")
+
+def calcular_itens(qtd_por_slug: dict) -> Items:
+    """Transforma as quantidades do formulário em arrays paralelos (Items) de itens com metadados."""
+    nomes, qtds, m3s, emps, max_emps, alturas = [], [], [], [], [], []
 
     for slug, qtd in qtd_por_slug.items():
         if qtd <= 0:
             continue
-        nome = slug_to_nome.get(slug)
-        if not nome:
+        meta = SLUG_TO_META.get(slug)
+        if meta is None:
             continue
-        meta = catalogo[nome]
-        itens.append({
-            "nome": nome,
-            "qtd": int(qtd),
-            "m3": meta["m3"],
-            "empilhavel": meta.get("empilhavel", False),
-            "max_emp": meta.get("max_emp", 1),
-            "altura": meta.get("altura", 0.5),
-        })
-    return itens
-
-def volume_para_box(itens: list, altura_box: float, folga: float = 0.15):
+        nome, m3, empilhavel, max_emp, altura = meta
+        nomes.append(nome)
+        qtds.append(int(qtd))
+        m3s.append(m3)
+        emps.append(empilhavel)
+        max_emps.append(max_emp)
+        alturas.append(altura)
+
+    return Items(
+        nome=nomes,
+        qtd=np.array(qtds, dtype=np.int64),
+        m3=np.array(m3s, dtype=np.float64),
+        empilhavel=np.array(emps, dtype=bool),
+        max_emp=np.array(max_emps, dtype=np.int64),
+        altura=np.array(alturas, dtype=np.float64),
+    )
+
+# Detalhe de UM item no box; pilhas e camadas são None para itens que não empilham
+Detalhe = namedtuple("Detalhe", "nome qtd pilhas v_item camadas altura")
+
+def volume_para_box(itens: Items, altura_box: float, folga: float = 0.15):
     """
     Calcula volume total (com folga) e altura máxima usada para UM box específico,
-    respeitando a altura do box no empilhamento.
+    respeitando a altura do box no empilhamento (mesmo núcleo usado na escolha do box).
     Retorna (volume_total, altura_maxima_usada, detalhes_por_item) ou (None, None, motivo) se algum item não couber.
+    Os detalhes são uma lista de Detalhe (valores numéricos crus; o cliente formata).
     """
-    total = 0.0
-    max_alt_uso = 0.0
-    detalhes = []
+    total, max_alt_uso, status = _vol_kernel(
+        itens.qtd, itens.m3, itens.altura, itens.max_emp, itens.empilhavel, altura_box, folga,
+    )
+    if status < 0:
+        i = -1 - status
+        return (None, None, f"{itens.nome[i]} não cabe em altura ({itens.altura[i]:.2f} m) no box de {altura_box:.2f} m")
 
-    for it in itens:
-        qtd = it["qtd"]
-        m3 = it["m3"]
-        alt = it["altura"]
-
-        if it["empilhavel"]:
-            # quantas camadas cabem na altura do box
-            camadas_por_pilha = int(altura_box // alt)
-            camadas_por_pilha = min(camadas_por_pilha, it["max_emp"])
-            if camadas_por_pilha < 1:
-                return (None, None, f"{it['nome']} não cabe em altura ({alt:.2f} m) no box de {altura_box:.2f} m")
-
-            pilhas = math.ceil(qtd / camadas_por_pilha)
-            v_item = pilhas * m3
-            total += v_item
-            altura_pilha = min(camadas_por_pilha, qtd) * alt
-            max_alt_uso = max(max_alt_uso, altura_pilha)
-
-            detalhes.append(
-                f"{qtd}× {it['nome']} → {pilhas} pilha(s), {v_item:.2f} m³ "
-                f"(camadas/pilha={camadas_por_pilha}, alt usada {altura_pilha:.2f} m)"
-            )
+    detalhes = []
+    for nome, qtd, m3, empilhavel, max_emp, alt in zip(
+        itens.nome, itens.qtd.tolist(), itens.m3.tolist(),
+        itens.empilhavel.tolist(), itens.max_emp.tolist(), itens.altura.tolist(),
+    ):
+        camadas, pilhas, v_item, altura = _empilhamento_item(qtd, m3, alt, max_emp, empilhavel, altura_box)
+        if empilhavel:
+            detalhes.append(Detalhe(nome, qtd, pilhas, v_item, camadas, altura))
         else:
-            v_item = qtd * m3
-            total += v_item
-            max_alt_uso = max(max_alt_uso, alt)
-            detalhes.append(f"{qtd}× {it['nome']} → {v_item:.2f} m³ (não empilha, altura {alt:.2f} m)")
+            detalhes.append(Detalhe(nome, qtd, None, v_item, None, altura))
 
-    total *= (1.0 + folga)
     return (total, max_alt_uso, detalhes)
 
-def escolher_box_por_altura(itens: list):
+@njit
+def _empilhamento_item(qtd, m3, alt, max_emp, stack, alt_box):
     """
-    Simula empilhamento respeitando a altura de CADA box.
-    Retorna (box_escolhido, volume_calc, altura_usada, detalhes) ou (None, None, None, motivo)
+    Regra de empilhamento de UM item em UM box (única cópia, usada na escolha e nos detalhes).
+    Retorna (camadas_por_pilha, pilhas, v_item, altura_usada); camadas < 1 num item empilhável
+    significa que ele não cabe em altura. Itens que não empilham voltam com camadas = pilhas = 0.
     """
-    candidatos = []
+    if stack:
+        # quantas camadas cabem na altura do box
+        c = min(max_emp, int(alt_box // alt))
+        if c < 1:
+            return (c, 0, 0.0, 0.0)
+        p = -(-qtd // c)
+        return (c, p, p * m3, min(c, qtd) * alt)
+    return (0, 0, qtd * m3, alt)
 
-    for _, box in df_boxes.iterrows():
-        altura_box = float(box["Altura"])
-        res = volume_para_box(itens, altura_box)
-        if isinstance(res, tuple) and len(res) == 3:
-            vol, alt_uso, detalhes = res
-        else:
-            vol = alt_uso = None
-            detalhes = res  # motivo
-        if vol is None:
-            # este box não comporta algum item em altura
+@njit
+def _vol_kernel(qtd, m3, alt, max_emp, stack, alt_box, folga):
+    """
+    Volume total (com folga) e altura máxima usada para UM box.
+    Retorna (volume_total, altura_maxima_usada, status); status = -1-i se o item i não couber em altura.
+    """
+    total = 0.0
+    max_a = 0.0
+    for i in range(qtd.size):
+        c, _, v_item, altura = _empilhamento_item(qtd[i], m3[i], alt[i], max_emp[i], stack[i], alt_box)
+        if stack[i] and c < 1:
+            return (0.0, 0.0, -1 - i)
+        total += v_item
+        if altura > max_a:
+            max_a = altura
+    return (total * (1.0 + folga), max_a, 0)
+
+@njit
+def _escolher_kernel(qtd, m3, alt, max_emp, stack, box_alturas, box_m3, folga):
+    """Índice do menor box (boxes ordenados por m³) que comporta os itens, ou -1."""
+    # altura mínima de box: todo item empilhável precisa de ao menos 1 camada
+    # (itens que não empilham nunca reprovam por altura em volume_para_box)
+    alt_min = 0.0
+    for i in range(qtd.size):
+        if stack[i] and alt[i] > alt_min:
+            alt_min = alt[i]
+
+    melhor = -1
+    melhor_vol = 0.0
+    for b in range(box_alturas.size):
+        # passou do grupo de boxes com o mesmo m³ do primeiro viável
+        if melhor >= 0 and box_m3[b] != box_m3[melhor]:
+            break
+        if box_alturas[b] < alt_min:
+            continue
+        total, _, status = _vol_kernel(qtd, m3, alt, max_emp, stack, box_alturas[b], folga)
+        if status != 0 or box_m3[b] < total:
             continue
-        if box["Metros Cubicos"] >= vol:
-            candidatos.append((vol, alt_uso, detalhes, box))
+        if melhor < 0 or total < melhor_vol:
+            melhor = b
+            melhor_vol = total
+    return melhor
 
-    if not candidatos:
+def escolher_box_por_altura(itens: Items, folga: float = 0.15):
+    """
+    Simula empilhamento respeitando a altura de CADA box (núcleo compilado com Numba).
+    Retorna (box_escolhido, volume_calc, altura_usada, detalhes) ou (None, None, None, motivo);
+    detalhes é a lista de Detalhe do box escolhido.
+    """
+    i = _escolher_kernel(
+        itens.qtd, itens.m3, itens.altura, itens.max_emp, itens.empilhavel,
+        BOX_ALTURAS, BOX_M3, folga,
+    )
+    if i < 0:
         return (None, None, None, "Nenhum box atende ao volume/altura após simular empilhamento pela altura do box.")
 
-    # escolhe o candidate com menor volume cúbico do box; em empate, o de menor volume calculado
-    candidatos.sort(key=lambda t: (t[3]["Metros Cubicos"], t[0]))
-    melhor = candidatos[0]
-    return (melhor[3], melhor[0], melhor[1], melhor[2])
+    vol, alt_uso, detalhes = volume_para_box(itens, float(BOX_ALTURAS[i]), folga)
+    return (BOX_META[i], vol, alt_uso, detalhes)
+
+# Compila os núcleos na importação, fora do tempo de requisição
+_aquecimento = Items(
+    nome=["-"], qtd=np.ones(1, dtype=np.int64), m3=np.ones(1), empilhavel=np.ones(1, dtype=bool),
+    max_emp=np.ones(1, dtype=np.int64), altura=np.ones(1),
+)
+_escolher_kernel(
+    _aquecimento.qtd, _aquecimento.m3, _aquecimento.altura, _aquecimento.max_emp,
+    _aquecimento.empilhavel, BOX_ALTURAS, BOX_M3, 0.15,
+)
+volume_para_box(_aquecimento, 1.0)
+del _aquecimento
 
 # ===========================
 # Rota principal (usa template index.html)
 # ===========================
+def calcular_box(form):
+    """Lê as quantidades do formulário (qty_<slug>) e escolhe o box. Retorna (box, vol, alt, detalhes)."""
+    raw_map = {k[4:]: v for k, v in form.items() if k.startswith("qty_")}
+    qtd_por_slug = {slug: parse_qtd(raw_map.get(slug)) for slug in ITEMS_SLUGS}
+
+    itens_sel = calcular_itens(qtd_por_slug)
+    return escolher_box_por_altura(itens_sel)
+
+@lru_cache(maxsize=None)
+def pagina_inicial():
+    """Renderiza o formulário vazio uma única vez (no primeiro GET) e calcula seu ETag."""
+    html = render_template("index.html", itens=ITENS_UI, resultado=None)
+    return html, hashlib.md5(html.encode(), usedforsecurity=False).hexdigest()
+
 @app.route("/", methods=["GET", "POST"])
 def index():
-    resultado_html = None
-    detalhes_html = None
-
-    if request.method == "POST":
-        # Lê quantidades do formulário (qty_<slug>)
-        qtd_por_slug = {}
-        for item in itens_ui:
-            field = f"qty_{item['slug']}"
-            raw = (request.form.get(field, "0") or "0").strip()
-            try:
-                qtd = int(raw)
-            except:
-                qtd = 0
-            qtd_por_slug[item["slug"]] = max(0, qtd)
-
-        itens_sel = calcular_itens(qtd_por_slug)
-        box, vol_calc, alt_usada, detalhes = escolher_box_por_altura(itens_sel)
-
-        # Detalhes
-        if itens_sel and isinstance(detalhes, list):
-            detalhes_html = "<b>Itens:</b><br>" + "<br>".join(detalhes)
-        elif isinstance(detalhes, str):
-            detalhes_html = detalhes
-        else:
-            detalhes_html = "—"
-
-        # Resultado
-        if box is not None:
-            resultado_html = (
-                f"<b>Box sugerido:</b> {box['Box']} - "
-                f"{box['Metros Quadrados']:.2f} m² - {box['Metros Cubicos']:.2f} m³"
-            )
-        else:
-            resultado_html = "❌ Nenhum box disponível atende ao volume/altura com empilhamento respeitando a altura do box."
+    # GET e HEAD (o Flask encaminha HEAD para esta view) recebem a página em cache
+    if request.method != "POST":
+        html, etag = pagina_inicial()
+        resp = Response(html)
+        resp.set_etag(etag)
+        return resp.make_conditional(request)
 
-    return render_template("index.html", itens=itens_ui, resultado=resultado_html)
+    box, _, _, _ = calcular_box(request.form)
+
+    # Resultado
+    if box is not None:
+        resultado_html = (
+            f"<b>Box sugerido:</b> {box['Box']} - "
+            f"{box['Metros Quadrados']:.2f} m² - {box['Metros Cubicos']:.2f} m³"
+        )
+    else:
+        resultado_html = "❌ Nenhum box disponível atende ao volume/altura com empilhamento respeitando a altura do box."
+
+    return render_template("index.html", itens=ITENS_UI, resultado=resultado_html)
+
+@app.route("/calc", methods=["POST"])
+def calc():
+    """
+    Mesmo cálculo da rota principal, em JSON (usado pelo formulário via fetch).
+    Números vão crus (o cliente formata); detalhes é sempre uma lista e o motivo da falha vai em "erro".
+    """
+    box, vol_calc, alt_usada, detalhes = calcular_box(request.form)
+    if box is None:
+        dados = {"box": None, "vol": None, "alt": None, "detalhes": [], "erro": detalhes}
+    else:
+        dados = {
+            "box": box,
+            "vol": vol_calc,
+            "alt": alt_usada,
+            "detalhes": [d._asdict() for d in detalhes],
+            "erro": None,
+        }
+    return Response(orjson.dumps(dados), mimetype="application/json")
 
 # ===========================
 # Run
+# Só para desenvolvimento local (FLASK_DEBUG=1 liga reloader/debugger).
+# Em produção use um servidor WSGI, p.ex.: gunicorn -w 4 -k gthread app:app
 # ===========================
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=os.environ.get("FLASK_DEBUG") == "1")